@@ -1,10 +1,11 @@
 import logging
 
 import cli
-from transcript import get_transcripts
+from transcript import get_annotated_alignments
 from annotations import Annotations
 
 VERSION = '0.0.1-SNAPSHOT'
+READ_BUFFER_SIZE = 1 << 20
 
 def main():
     r"""
@@ -24,23 +25,28 @@ def main():
         parser.print_help()
         exit(1)
 
-    with open(args.features) as features_file:
+    with open(args.features, buffering=READ_BUFFER_SIZE) as features_file:
         annotations = Annotations(features_file)
 
-    with open(args.alignment) as alignment_file:
-        alignments = alignment_file.readlines()
-
-    headers = filter(lambda l: l.startswith('@'), alignments)
-    headers = map(str.strip, headers)
-    alignments = filter(lambda l: not l.startswith('@'), alignments)
-
-    transcripts = get_transcripts(
-            alignments, args.skip_tolerance, args.map_tolerance)
-
-    print('\n'.join(headers))
-    for transcript in transcripts:
-        transcript.annotate(annotations, args.junction_tolerance)
-        print(transcript)
+    headers = []
+
+    def get_alignments(alignment_file):
+        # Headers are set aside as the file is read, in a single pass
+        for line in alignment_file:
+            if line.startswith('@'):
+                headers.append(line.strip())
+            else:
+                yield line
+
+    with open(args.alignment, buffering=READ_BUFFER_SIZE) \
+            as alignment_file:
+        annotated = get_annotated_alignments(get_alignments(alignment_file),
+                annotations, args.skip_tolerance, args.map_tolerance,
+                args.junction_tolerance, args.processes)
+
+        print('\n'.join(headers))
+        for sam in annotated:
+            print(sam)
 
 def setup_logging(args):
     r"""
@@ -1,8 +1,11 @@
-import logging
+import logging, re
+from bisect import bisect_right
 from splice_list import SpliceList
 
 logger = logging.getLogger('trcls')
 
+_TRANSCRIPT_ID_RE = re.compile(r'transcript_id\s+"?([^";\s]+)')
+
 class Annotations:
     r"""
     A set of known splice variants and precursor mRNA.
@@ -29,70 +32,58 @@ class Annotations:
             Annotation file describing all splice variants found in the region
             of the alignment.
         """
-        # lines is a list of exons only
-        lines = gtf_file.readlines()
-        lines = map(lambda line: line.split('\t'), lines)
-        lines = filter(lambda line: line[2] == 'exon', lines)
-        lines = list(lines)
-
+        # Read the file line by line, keeping exons only. The attribute field
+        # is last, so splitting stops there.
         lines2 = []  # contains tuple<start, stop, transcript_id>
-        for line in lines:
+        for line in gtf_file:
+            if line.startswith('#'):
+                continue
+            line = line.split('\t', 8)
+            if len(line) < 9 or line[2] != 'exon':
+                continue
             start, stop = int(line[3]), int(line[4])
-            transcript_id = line[-1].split(';')
-            transcript_id = next(filter(
-                    lambda field: 'transcript_id' in field, transcript_id))
-            transcript_id = transcript_id.replace('transcript_id', '')
-            transcript_id = transcript_id.replace('"', '')
-            transcript_id = transcript_id.strip()
+            transcript_id = _TRANSCRIPT_ID_RE.search(line[8]).group(1)
             lines2.append((start, stop, transcript_id))
 
-        precursor_start = None
-        precursor_end = None
         variants = []
-        exons = []
-        current_variant = lines2[0][2]
-        for triple in lines2:
-            # Tracking exons of the same splice variant
-            if triple[-1] == current_variant:
-                exons.append(triple[0:2])
-            # A new splice variant has appeared
-            else:
-                # Add it to variants as a SpliceList
-                should_reverse = exons[0][0] > exons[0][1]
-                if should_reverse:
-                    exons = list(map(sorted, exons))
-                    exons = sorted(exons, key=lambda pair: pair[0])
-                variants.append(SpliceList( current_variant, exons,
-                        set_left_junction=True, set_right_junction=True))
 
-                precursor_start = exons[0][0] if precursor_start == None \
-                        else min(precursor_start, exons[0][0])
-                precursor_end = exons[-1][1] if precursor_end == None \
-                        else max(precursor_end, exons[-1][1])
-
-                # Reset
-                exons = [triple[0:2]]
-                current_variant = triple[2]
-        else:
-            # Clean-up the last splice variant
-            should_reverse = exons[0][0] > exons[0][1]
-            if should_reverse:
-                exons = list(map(sorted, exons))
-                exons = sorted(exons, key=lambda pair: pair[0])
-            variants.append(SpliceList(current_variant, exons,
+        def add_variant(identifier, exons):
+            # Exons may be given with start > stop, e.g. on the reverse strand.
+            # Returns the span of the variant.
+            exons = sorted((min(start, stop), max(start, stop))
+                    for start, stop in exons)
+            variants.append(SpliceList(identifier, exons,
                     set_left_junction=True, set_right_junction=True))
+            return exons[0][0], exons[-1][1]
 
-            precursor_start = exons[0][0] if precursor_start == None \
-                    else min(precursor_start, exons[0][0])
-            precursor_end = exons[-1][1] if precursor_end == None \
-                    else max(precursor_end, exons[-1][1])
-            variants.append(
-                    SpliceList('pre-mRNA', [(precursor_start, precursor_end)],
-                            set_left_junction=True, set_right_junction=True))
+        spans = []
+        exons = []
+        current_variant = lines2[0][2]
+        for start, stop, transcript_id in lines2:
+            # A new splice variant has appeared; add the last one to variants
+            if transcript_id != current_variant:
+                spans.append(add_variant(current_variant, exons))
+                exons = []
+                current_variant = transcript_id
+            exons.append((start, stop))
+        spans.append(add_variant(current_variant, exons))
+
+        precursor_start = min(span[0] for span in spans)
+        precursor_end = max(span[1] for span in spans)
+        variants.append(
+                SpliceList('pre-mRNA', [(precursor_start, precursor_end)],
+                        set_left_junction=True, set_right_junction=True))
 
         self.variants = variants
-        logger.debug('Instantiated annotations with\n{}'.format(
-                '\n\t'.join([str(sl) for sl in self.variants])))
+        # (start, stop, index) of each variant ordered by start, so that
+        # get_annotations need only consider variants overlapping a transcript
+        self._spans = sorted(
+                (variant.regions[0].start, variant.regions[-1].stop, i)
+                for i, variant in enumerate(variants))
+        self._span_starts = [span[0] for span in self._spans]
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Instantiated annotations with\n{}'.format(
+                    '\n\t'.join([str(sl) for sl in self.variants])))
 
     def get_annotations(self, transcript, junction_tolerance):
         r"""
@@ -117,18 +108,29 @@ class Annotations:
             precursor mRNA which this transcript could have originated from.
         """
         # Get list of all splice_lists in transcript
-        transcript_splice_lists = list(map(
-                lambda t: t.splice_list, transcript.segments))
+        transcript_splice_lists = [
+                segment.splice_list for segment in transcript.segments]
         # Merge the splice_lists
         transcript_splice_lists_merged = SpliceList.join_many(
                 *transcript_splice_lists)
-        # Get True/False for possible matches in self.variants
-        matches = map(lambda v:
-                v.contains(transcript_splice_lists_merged, junction_tolerance),
-                self.variants)
-        possible_annotations = []
-        for variant, contains_transcript in zip(self.variants, matches):
-            if contains_transcript:
-                possible_annotations.append(variant.identifier)
-
-        return possible_annotations
+        candidates = self._get_overlapping(
+                transcript_splice_lists_merged, junction_tolerance)
+        return [variant.identifier for variant in candidates if
+                variant.contains(
+                        transcript_splice_lists_merged, junction_tolerance)]
+
+    def _get_overlapping(self, splice_list, junction_tolerance):
+        r"""
+        Get the variants, in order, which may contain the given ``SpliceList``.
+        A variant which does not overlap the ``SpliceList`` at all leaves every
+        region overhanging, so it cannot contain the ``SpliceList`` unless all
+        of its regions are within junction_tolerance.
+        """
+        regions = splice_list.regions
+        if all(r.stop - r.start + 1 <= junction_tolerance for r in regions):
+            return self.variants
+
+        end = bisect_right(self._span_starts, regions[-1].stop)
+        overlapping = sorted(i for _, stop, i in self._spans[:end]
+                if stop >= regions[0].start)
+        return [self.variants[i] for i in overlapping]
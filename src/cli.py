@@ -3,6 +3,7 @@ import argparse
 DEFAULT_JUNCTION = 20
 DEFAULT_MAP = 10
 DEFAULT_SKIP = 20
+DEFAULT_PROCESSES = 1
 
 def get_parser():
     r"""
@@ -34,6 +35,12 @@ def get_parser():
             help=(
                     'number of nt exon-intron junctions allowed to mismatch by '
                     '(default: {})'.format(DEFAULT_JUNCTION)))
+    parser.add_argument('--processes', '-p',
+            type=int, default=DEFAULT_PROCESSES,
+            help=(
+                    'number of processes to read and annotate transcripts '
+                    'with '
+                    '(default: {})'.format(DEFAULT_PROCESSES)))
 
     parser.add_argument('--quiet', '-q', action='store_true',
             help='show only error (ERROR) messages')
@@ -1,7 +1,12 @@
 import logging
+from bisect import bisect_left, bisect_right
 
 logger = logging.getLogger('trcls')
 
+# Junction types, also available as Junction.TYPE_START and Junction.TYPE_END
+TYPE_START = 0
+TYPE_END = 1
+
 class SpliceList:
     r"""
     Ordered list of expressed regions and splice junctions representing a splice
@@ -57,25 +62,43 @@ class SpliceList:
                         identifier, this_exon, next_exon))
 
         components = []
+        regions = []
+        junctions = []
         for exon in exons:
-            components.append(Junction(exon[0], Junction.TYPE_START))
-            components.append(Region(*exon))
-            components.append(Junction(exon[1], Junction.TYPE_END))
-        self.components = components
+            start = Junction(exon[0], TYPE_START)
+            region = Region(*exon)
+            end = Junction(exon[1], TYPE_END)
+            components += [start, region, end]
+            regions.append(region)
+            junctions += [start, end]
 
         if set_left_junction:
-            self.components[0].has_complement = True
+            components[0].has_complement = True
         else:
-            self.components = self.components[1:]
+            components = components[1:]
+            junctions = junctions[1:]
         if set_right_junction:
-            self.components[-1].has_complement = True
+            components[-1].has_complement = True
         else:
-            self.components = self.components[:-1]
+            components = components[:-1]
+            junctions = junctions[:-1]
+
+        self.components = components
+        self.regions = regions
+        self.junctions = junctions
+        self._index_junctions()
 
-        self.regions = list(filter(
-                lambda x: type(x) == Region, self.components))
-        self.junctions = list(filter(
-                lambda x: type(x) == Junction, self.components))
+    def _index_junctions(self):
+        r"""
+        Index the ``Junction``\ s by type, as ordered lists of positions and of
+        their indices in junctions, so that matching junctions can be found by
+        binary search.
+        """
+        self._junction_positions = {TYPE_START: [], TYPE_END: []}
+        self._junction_indices = {TYPE_START: [], TYPE_END: []}
+        for i, j in enumerate(self.junctions):
+            self._junction_positions[j.type].append(j.position)
+            self._junction_indices[j.type].append(i)
 
     def contains(self, other_sl, junction_tolerance):
         r"""
@@ -89,55 +112,60 @@ class SpliceList:
            must also match **in order**, i.e. no skips are allowed. This
            identifies splice variants with exon skipping more sensitively.
         """
-        # Find the intersect of other_sl.regions and self.regions
-        other_regions = set.union(
-                *[ set(range(r.start, r.stop+1)) for r in other_sl.regions ])
-        this_regions = set.union(
-                *[ set(range(r.start, r.stop+1)) for r in self.regions ])
-        # Set difference is not associative! For overhangs, take others - this
-        overhangs = list(other_regions.difference(this_regions))
-        # Check if any other the overhangs > junction_tolerance
-        max_overhang_distance = 0
-        last_position = -1  # an init value, positions >= 1
-        for pos in overhangs:
-            # if adjacent to the last position
-            if pos - last_position == 1:
-                max_overhang_distance += 1
-            else:
-                max_overhang_distance = 1
-            last_position = pos
-
-            if max_overhang_distance > junction_tolerance:
+        # Sweep the regions of other_sl against the regions of this SpliceList,
+        # checking that no overhang (a contiguous run of positions in other_sl
+        # but not here) is longer than junction_tolerance. Adjacent regions of
+        # other_sl are merged first, as an overhang may run across them.
+        this_regions = self.regions
+        num_regions = len(this_regions)
+        i = 0
+        for start, stop in _merge_regions(other_sl.regions):
+            # Skip the regions here which end before this other region
+            while i < num_regions and this_regions[i].stop < start:
+                i += 1
+            # First position of the other region not yet known to be covered
+            uncovered = start
+            j = i
+            while j < num_regions and this_regions[j].start <= stop:
+                if this_regions[j].start - uncovered > junction_tolerance:
+                    return False
+                uncovered = max(uncovered, this_regions[j].stop + 1)
+                j += 1
+            if stop + 1 - uncovered > junction_tolerance:
                 return False
 
         # For all junctions in other_sl, check that there is a match here
+        junction_positions = self._junction_positions
         match_order = []
         for j in other_sl.junctions:
-            has_match = False
-            check_range = set(range(
-                    j.position-junction_tolerance,
-                    j.position+junction_tolerance+1))
-            for i, this_j in enumerate(self.junctions):
-                if this_j.type == j.type and this_j.position in check_range:
-                    if j.complement != None:
-                        match_order.append(i)  # preparing to check complements
-                    has_match = True
-                    continue
-            if not has_match:
+            positions = junction_positions[j.type]
+            lo = bisect_left(positions, j.position-junction_tolerance)
+            if lo == len(positions) or \
+                    positions[lo] > j.position+junction_tolerance:
                 return False
-
-        logger.debug(
-                '{} contains {}?\n\tself.junctions: {}\n\t'
-                'other_sl.junctions: {}'.format(
-                    self.identifier, other_sl.identifier,
-                    [str(j) for j in self.junctions],
-                    [str(j) for j in other_sl.junctions]))
+            if j.complement != None:
+                # preparing to check complements
+                hi = bisect_right(
+                        positions, j.position+junction_tolerance, lo)
+                match_order.extend(self._junction_indices[j.type][lo:hi])
+
+        # contains is called for every transcript against every variant, so
+        # only format the debug messages if they will be shown
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug(
+                    '{} contains {}?\n\tself.junctions: {}\n\t'
+                    'other_sl.junctions: {}'.format(
+                        self.identifier, other_sl.identifier,
+                        [str(j) for j in self.junctions],
+                        [str(j) for j in other_sl.junctions]))
         # Check if the transcript's complementing Junctions are also
         # complementing in the annotation.
         for i in range(0, len(match_order)-1, 2):
-            logger.debug('{} contains {}? match_order[{}:{}] == [{}, {}]'
-                    .format(self.identifier, other_sl.identifier, i, i+2,
-                    match_order[i], match_order[i+1]))
+            if debug:
+                logger.debug('{} contains {}? match_order[{}:{}] == [{}, {}]'
+                        .format(self.identifier, other_sl.identifier, i, i+2,
+                        match_order[i], match_order[i+1]))
             if abs(match_order[i] - match_order[i+1]) > 1:
                 return False
 
@@ -167,46 +195,38 @@ class SpliceList:
         """
         identifier = sl1.identifier if sl1.identifier == sl2.identifier else \
                 '{},{}'.format(sl1.identifier, sl2.identifier)
-        mapped = [set(range(r.start, r.stop+1)) \
-                for r in sl1.regions + sl2.regions]
-        mapped = sorted(list(set.union(*mapped)))
-
-        exons = []
-        start = None
-        last = 0
-        for pos in mapped:
-            if start == None:
-                start = pos
-                last = pos
-            elif pos - last == 1:
-                last += 1
-            else:
-                exons.append([start, last])
-                start = pos
-                last = pos
-        else:
-            exons.append([start, pos])
-
-        regions = [Region(*coords) for coords in exons]
-        _junctions = set(sl1.junctions).union(sl2.junctions)
+        merged = _merge_regions(sorted(
+                sl1.regions + sl2.regions, key=lambda r: r.start))
+        # A junction lies at an edge of its own region, so it lies within an
+        # unbroken merged region unless it is also at an edge of one.
+        merged_starts = {start for start, _ in merged}
+        merged_stops = {stop for _, stop in merged}
+
+        regions = [Region(*coords) for coords in merged]
+        # Equal junctions may come from both SpliceLists; keep one of each,
+        # preferring the one with a complement.
+        _junctions = {}
+        for j in sl1.junctions + sl2.junctions:
+            if _junctions.setdefault(j, j).complement is None:
+                _junctions[j] = j
         junctions = []
-        for j in _junctions:
-            if j.type == Junction.TYPE_START and not j.position-1 in mapped:
+        for j in _junctions.values():
+            if j.type == TYPE_START and j.position in merged_starts:
                 junctions.append(j)
-            elif j.type == Junction.TYPE_END and not j.position+1 in mapped:
+            elif j.type == TYPE_END and j.position in merged_stops:
                 junctions.append(j)
 
-        components = regions + junctions
-        components = sorted(components,
-                key=lambda c: c.start if type(c) == Region else c.position)
-        regions = list(filter(lambda c: type(c) == Region, components))
-        junctions = list(filter(lambda c: type(c) == Junction, components))
+        # regions are already ordered, as merged is
+        junctions.sort(key=lambda j: j.position)
+        components = sorted(regions + junctions,
+                key=lambda c: c.start if isinstance(c, Region) else c.position)
 
         new_sl = SpliceList('', [])
         new_sl.identifier = identifier
         new_sl.components = components
         new_sl.junctions = junctions
         new_sl.regions = regions
+        new_sl._index_junctions()
 
         return new_sl
 
@@ -225,11 +245,16 @@ class SpliceList:
         -------
         SpliceList
         """
-        joined = sls[0]
-        for sl in sls[1:]:
-            joined = SpliceList.join(joined, sl)
-
-        logger.debug('Joined transcripts to\n\t{}'.format(joined))
+        # Join in pairwise rounds so that each SpliceList takes part in
+        # O(log n) joins, rather than joining onto an ever growing SpliceList.
+        level = list(sls)
+        while len(level) > 1:
+            level = [SpliceList.join(*level[i:i+2]) if i+1 < len(level) \
+                    else level[i] for i in range(0, len(level), 2)]
+        joined = level[0]
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Joined transcripts to\n\t{}'.format(joined))
         return joined
 
 
@@ -247,6 +272,8 @@ class Region:
         than or equal to the ``start``.
     """
 
+    __slots__ = ('start', 'stop')
+
     def __init__(self, start, stop):
         r"""
         Parameters
@@ -287,8 +314,10 @@ class Junction:
         nucleotide position.
     """
 
-    TYPE_START = 0
-    TYPE_END = 1
+    __slots__ = ('position', 'type', 'complement', 'has_complement')
+
+    TYPE_START = TYPE_START
+    TYPE_END = TYPE_END
 
     def __init__(self, position, _type):
         r"""
@@ -312,9 +341,16 @@ class Junction:
         self.complement = None
         self.has_complement = False
 
+    def __eq__(self, other):
+        return isinstance(other, Junction) and \
+                self.position == other.position and self.type == other.type
+
+    def __hash__(self):
+        return hash((self.position, self.type))
+
     def __str__(self):
         return 'junction ({}) at {}{}'.format(
-                'start' if self.type == self.TYPE_START else 'end',
+                'start' if self.type == TYPE_START else 'end',
                 self.position,
                 ' with complement at {}'.format(self.complement.position)
                     if self.complement != None else '')
@@ -325,3 +361,17 @@ class OverlappingExonsError(Exception):
     each other.
     """
     pass
+
+def _merge_regions(regions):
+    r"""
+    Given a sequence iterable of ``Region``\ s ordered by start position, get a
+    ``list`` of (start, stop) tuples where overlapping or adjacent regions are
+    merged.
+    """
+    merged = []
+    for region in regions:
+        if merged != [] and region.start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], region.stop))
+        else:
+            merged.append((region.start, region.stop))
+    return merged
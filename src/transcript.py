@@ -1,8 +1,19 @@
-import logging, re
+import functools, logging, re
+from collections import deque
+from itertools import accumulate, groupby
+from multiprocessing import Pool
 from splice_list import SpliceList, Region
 
 logger = logging.getLogger('trcls')
 
+# The least number of read groups for which get_annotated_alignments uses a
+# pool of worker processes
+POOL_MIN_GROUPS = 1000
+
+_CIGAR_RE = re.compile(r'(\d+)([MIDNSHP=X])')
+# CIGAR strings of a single match, soft clipped on either side or both
+_CLIPPED_MATCH_CIGAR_RE = re.compile(r'\A(?:(\d+)S)?(\d+)M(?:(\d+)S)?\Z')
+
 class Transcript:
     r"""
     A read transcript, e.g. a read pair.
@@ -54,17 +65,20 @@ class Transcript:
         # mRNA spanning both exons on each side of that junction.
         c_lists = [segment.splice_list.components for segment in self.segments]
         components = [c for c_list in c_lists for c in c_list]
+        # Only the Junctions which may have a complement need be considered;
+        # find them once, rather than for each adjacent pair
+        can_complement = [not isinstance(c, Region) and c.has_complement
+                for c in components]
         for i in range(0, len(components)-1):
-            if type(components[i]) == Region or type(components[i+1]) == Region:
+            if not (can_complement[i] and can_complement[i+1]):
                 continue
-            elif components[i].type != components[i+1].type and \
-                    components[i].has_complement and \
-                    components[i+1].has_complement:
+            elif components[i].type != components[i+1].type:
                 components[i].complement = components[i+1]
                 components[i+1].complement = components[i]
 
-        logger.debug('Transcript instantiated with\n\t<{}>'.format(
-                '\n\t'.join(str(segment) for segment in self.segments)))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Transcript instantiated with\n\t<{}>'.format(
+                    '\n\t'.join(str(segment) for segment in self.segments)))
 
     def annotate(self, annotations, junction_tolerance):
         r"""
@@ -107,9 +121,12 @@ class Segment:
         Annotate this segment with the TR:Z optional field.
     """
 
-    _CIGAR_MAPPING = ('M', 'D', 'N', '=', 'X')
     _CIGAR_MAPS_BOTH = ('M', '=', 'X')
     _CIGAR_MAPS_REF = ('D', 'N')
+    # Encoding of the operations mapping the reference when finding regions:
+    # non-skips as True, and skips as False
+    _CIGAR_ENCODING = dict.fromkeys(_CIGAR_MAPS_REF, False)
+    _CIGAR_ENCODING.update(dict.fromkeys(_CIGAR_MAPS_BOTH, True))
 
     def __init__(self, sam, skip_tolerance, map_tolerance):
         r"""
@@ -127,14 +144,15 @@ class Segment:
             considered an exon.
         """
         self.sam = sam
-        region_list, set_junctions = self._get_region_list(
-                sam, skip_tolerance, map_tolerance)
+        # Split once, up to CIGAR
+        fields = sam.split('\t', 6)
+        region_list, set_junctions = self._get_cigar_region_list(
+                int(fields[3]), fields[5], skip_tolerance, map_tolerance)
         if region_list == []:
             # the mapped regions exist but are all within map_tolerance,
             # so nonw are counted as a 'region'
             raise NoMappingError
-        self.splice_list = SpliceList(
-                self.sam.split('\t')[0], region_list, **set_junctions)
+        self.splice_list = SpliceList(fields[0], region_list, **set_junctions)
 
     def __str__(self):
         return '{} <{}>'.format(_get_qname(self.sam), str(self.splice_list))
@@ -164,103 +182,16 @@ class Segment:
         self.sam = '\t'.join([self.sam, TR_tag])
 
     @classmethod
-    def _get_region_list(cls, sam_alignment, skip_tolerance, map_tolerance):
-        r"""
-        Get a list of regions which this segment spans.
-        """
-        position = int(sam_alignment.split('\t')[3])
-        cigar_v = cls._expand_cigar(sam_alignment.split('\t')[5])
-
-        # Remove ops mapping the transcript only (e.g. insertions into ref); but
-        # retain soft_clips to determine if SpliceList should mark the left or
-        # right or both ends as Junctions.
-        cigar_v = filter(lambda op: op in cls._CIGAR_MAPPING + ('S',), cigar_v)
-        cigar_v = ''.join(cigar_v)
-        left_soft_clip = re.match(r'\AS+', cigar_v)
-        should_set_left_junction = False if left_soft_clip == None \
-                else len(left_soft_clip.group()) > skip_tolerance
-        right_soft_clip = re.search(r'S+\Z', cigar_v)
-        should_set_right_junction = False if right_soft_clip == None \
-                else len(right_soft_clip.group()) > skip_tolerance
-        # Once soft clips are checked, remove them
-        cigar_v = filter(lambda op: not op == 'S', cigar_v)
-        # Encode non-skips as True and skips as False
-        cigar_v = map(
-                lambda op: True if op in cls._CIGAR_MAPS_BOTH else False, cigar_v)
-        # Re-represent as list<tuple<boolean, occurences>>
-        cigar_buffer = []  # elem: tuple<value, occurences>
-        times_skipped = 0
-        for op in cigar_v:
-            # Init step
-            if cigar_buffer == []:
-                cigar_buffer.append([op, 1])
-            # If this op is the same as the last
-            elif op == cigar_buffer[-1][0]:
-                cigar_buffer[-1][1] += 1
-            # This op is not the same as the last
-            else:
-                cigar_buffer.append([op, 1])
-        # Transform skips to non-skips according to skip_tolerance
-        cigar_buffer = map(
-                lambda pair: (True, pair[1]) if \
-                        pair[0] == False and pair[1] <= skip_tolerance else \
-                        pair,
-                cigar_buffer)
-        # Merge adjacent non-skips
-        cigar_buffer2 = []
-        for pair in cigar_buffer:
-            # Init step
-            if cigar_buffer2 == []:
-                cigar_buffer2.append(pair)
-            # Should merge
-            elif pair[0] == cigar_buffer2[-1][0]:
-                cigar_buffer2[-1][1] += pair[1]
-            # Shouldn't merge
-            else:
-                cigar_buffer2.append(pair)
-        # Translate skip and non-skip as regions. Follow the GTF indexing:
-        # 1-based, inclusive on both sides.
-        regions = []
-        for region in cigar_buffer2:
-            if region[0] == True:
-                regions.append([position, position+region[1]-1])
-                position += region[1]
-            else:
-                position += region[1]
-
-        # remove exons which span < map_tolerance
-        within_tolerance = []
-        for region in regions:
-            if not region[1] - region[0] + 1 < map_tolerance:
-                within_tolerance.append(region)
-
-        return (within_tolerance, {
-                        'set_left_junction': should_set_left_junction,
-                        'set_right_junction': should_set_right_junction})
-
-    @staticmethod
-    def _expand_cigar(cigar):
+    def _get_cigar_region_list(
+            cls, position, cigar, skip_tolerance, map_tolerance):
         r"""
-        Expands a CIGAR string such that the length of the string is the number
-        of CIGAR operations, and each character at its index is equal to the
-        operation at that CIGAR 'step'.
+        Get a list of regions spanned by a segment mapped at the given position
+        with the given CIGAR string.
         """
-        if cigar == '*':
-            raise NoMappingError
-        expanded = ''
-        number_of_operations = None  # also a flag for the parse state
-        for char in cigar:
-            # the start of a number
-            if char.isnumeric() and number_of_operations == None:
-                number_of_operations = char
-            # the continuation of a number
-            elif char.isnumeric():
-                number_of_operations += char
-            # the naming of an operation
-            else:
-                expanded += int(number_of_operations) * char
-                number_of_operations = None
-        return expanded
+        offsets, set_junctions = _get_region_offsets(
+                cigar, skip_tolerance, map_tolerance)
+        return ([[position+start, position+stop] for start, stop in offsets],
+                dict(set_junctions))
 
 
 class NoMappingError(Exception):
@@ -285,9 +216,9 @@ def get_transcripts(alignments, skip_tolerance, map_tolerance):
 
     Parameters
     ----------
-    alignments : sequence
-        Sequence iterable of SAM alignment lines. Each line should be stripped
-        (i.e. no newline character at the end).
+    alignments : iterable
+        Iterable of SAM alignment lines, e.g. a file, which is read once. Each
+        line is stripped as it is read.
     skip_tolerance : int
         The minimum number of reference skips e.g. deletions, soft clips; for
         two regions at either end of the skip to be considered as separate
@@ -299,8 +230,9 @@ def get_transcripts(alignments, skip_tolerance, map_tolerance):
 
     Returns
     -------
-    map
-        Iterable map object of ``Transcript``\ s.
+    list
+        ``list`` of ``Transcript``\ s, in the order of their read groups.
+        Read groups without mapped segments are left out.
     """
     transcript_groups = _get_read_groups(alignments)
     transcripts = []
@@ -311,6 +243,101 @@ def get_transcripts(alignments, skip_tolerance, map_tolerance):
             pass
     return transcripts
 
+def get_annotated_alignments(alignments, annotations,
+        skip_tolerance, map_tolerance, junction_tolerance, processes=1):
+    r"""
+    Get the ``Transcript``\ s for many alignments, as with
+    ``get_transcripts``, and annotate them, as with ``Transcript.annotate``.
+
+    Parameters
+    ----------
+    alignments : iterable
+        Iterable of SAM alignment lines, e.g. a file, which is read once. Each
+        line is stripped as it is read.
+    annotations : Annotations
+        Reference annotations.
+    skip_tolerance : int
+        The minimum number of reference skips e.g. deletions, soft clips; for
+        two regions at either end of the skip to be considered as separate
+        exons. Alternatively, the maximum reference skip distance allowed in an
+        exon.
+    map_tolerance : int
+        The minimum number of nucleotides mapped in a row before they are
+        considered an exon.
+    junction_tolerance : int
+        Number of nucleotides which the transcript junctions are allowed to
+        differ in position from a splice variant's junction such that the
+        transcript can still be considered as being from the splice variant.
+    processes : int
+        Number of processes to get and annotate the transcripts with. If more
+        than one, and there are at least ``POOL_MIN_GROUPS`` read groups, the
+        read groups are sent to a pool of worker processes, each holding its
+        own copy of annotations. Each worker builds and annotates the
+        ``Transcript``\ s of its read groups, and only sends back their
+        annotated SAM alignment lines.
+
+    Returns
+    -------
+    list
+        ``list`` of ``str``, the annotated SAM alignment lines of each
+        ``Transcript`` joined by newlines, in the order of their read groups.
+        Read groups without mapped segments are left out.
+    """
+    transcript_groups = _get_read_groups(alignments)
+    if not _use_pool(len(transcript_groups), processes):
+        annotated = (_get_annotated(group, annotations, skip_tolerance,
+                map_tolerance, junction_tolerance)
+                for group in transcript_groups)
+        return [sam for sam in annotated if sam != None]
+
+    with Pool(processes, initializer=_init_annotator, initargs=(annotations,
+            skip_tolerance, map_tolerance, junction_tolerance)) as pool:
+        # imap keeps the order of read groups
+        annotated = pool.imap(
+                _get_annotated_in_worker, transcript_groups, chunksize=256)
+        return [sam for sam in annotated if sam != None]
+
+def _get_annotated(group, annotations,
+        skip_tolerance, map_tolerance, junction_tolerance):
+    r"""
+    Given a read group, get the annotated SAM alignment lines of its
+    ``Transcript``, or ``None`` if none of its segments are mapped.
+    """
+    try:
+        transcript = Transcript(group, skip_tolerance, map_tolerance)
+    except NoMappedSegmentsError:
+        return None
+    transcript.annotate(annotations, junction_tolerance)
+    return str(transcript)
+
+def _use_pool(n, processes):
+    r"""
+    Given the number of items to work on and the number of processes allowed,
+    check if a pool of worker processes should be used. Starting a pool, and
+    sending each worker its arguments, costs more than it saves for few items.
+    """
+    return processes > 1 and n >= POOL_MIN_GROUPS
+
+# Arguments of _get_annotated, other than the read group, held by each
+# get_annotated_alignments worker
+_annotator = None
+
+def _init_annotator(
+        annotations, skip_tolerance, map_tolerance, junction_tolerance):
+    r"""
+    Initialises a get_annotated_alignments worker process.
+    """
+    global _annotator
+    _annotator = (
+            annotations, skip_tolerance, map_tolerance, junction_tolerance)
+
+def _get_annotated_in_worker(group):
+    r"""
+    Given a read group, get the annotated SAM alignment lines of its
+    ``Transcript`` in a get_annotated_alignments worker process.
+    """
+    return _get_annotated(group, *_annotator)
+
 def _get_read_groups(alignments):
     r"""
     Group alignments according to read groups (most commonly read pairs,
@@ -318,8 +345,9 @@ def _get_read_groups(alignments):
 
     Parameters
     ----------
-    alignments : sequence
-        Sequence iterable of SAM alignment lines.
+    alignments : iterable
+        Iterable of SAM alignment lines, which is read once. Each line is
+        stripped as it is read.
 
     Returns
     -------
@@ -329,59 +357,80 @@ def _get_read_groups(alignments):
         line.
     """
 
-    alignments = list(map(str.strip, alignments))
-
-    is_grouped = lambda line: _get_flags(line) & 0x1 == 0x1
-    is_ungrouped = lambda line: not is_grouped(line)
-    is_first_segment = lambda line: _get_flags(line) & 0x40 == 0x40
-    is_last_segment = lambda line: _get_flags(line) & 0x80 == 0x80
-
-    # Extract tthe alignments which are not in read groups
-    alignments_ungrouped = list(filter(is_ungrouped, alignments))
-
-    # Extract he alignments which are in read groups
-    alignments_grouped = list(filter(is_grouped, alignments))
-    grouped_first = list(filter(is_first_segment, alignments_grouped))
-    grouped_last = list(filter(is_last_segment, alignments_grouped))
-    grouped_middle = list(filter(
-            lambda seg: not is_first_segment(seg) and  not is_last_segment(seg),
-            alignments_grouped))
-    num_grouped = {'total_segments': len(alignments_grouped), 'has_group': 0}
+    # Grouped alignments are kept as tuple<line, flags, qname, rnext>
+    get_qname = lambda record: record[2]
+    get_rnext = lambda record: record[3]
+    is_last_segment = lambda record: record[1] & 0x80 == 0x80
+
+    # Sort the alignments into those which are not in read groups, and the
+    # first, last and middle segments of those which are, in a single pass.
+    # Only the alignments in read groups need splitting past FLAG.
+    alignments_ungrouped = []
+    grouped_first = []
+    grouped_last = []
+    grouped_middle = []
+    num_grouped = {'total_segments': 0, 'has_group': 0}
+    for alignment in alignments:
+        alignment = alignment.strip()
+        qname, flags, fields = alignment.split('\t', 2)
+        flags = int(flags)
+        if flags & 0x1 != 0x1:
+            alignments_ungrouped.append(alignment)
+            continue
+        # RNEXT is the fifth field after FLAG
+        record = (alignment, flags, qname, fields.split('\t', 5)[4])
+        num_grouped['total_segments'] += 1
+        if flags & 0x40 == 0x40:
+            grouped_first.append(record)
+        if flags & 0x80 == 0x80:
+            grouped_last.append(record)
+        if flags & 0xC0 == 0:
+            grouped_middle.append(record)
 
     # Get read groups by starting from the first segment in the group, following
     # the RNEXT tag, until a last segment in the group in found.
     grouped_orphans = []
     read_groups = []
     read_group = []
+    # Index the middle and last segments by QNAME, so that the next segment
+    # is looked up rather than searched for. Segments are marked as consumed
+    # rather than removed, so that the leftovers keep their order.
+    middle_by_qname = {}
+    for i, record in enumerate(grouped_middle):
+        middle_by_qname.setdefault(get_qname(record), deque()).append(i)
+    middle_consumed = [False] * len(grouped_middle)
+    last_by_qname = {}
+    for i, record in enumerate(grouped_last):
+        last_by_qname.setdefault(get_qname(record), deque()).append(i)
+    last_consumed = [False] * len(grouped_last)
+
+    def pop_by_qname(by_qname, qname, grouped, consumed):
+        indices = by_qname[qname]
+        i = indices.popleft()
+        if not indices:
+            del by_qname[qname]
+        consumed[i] = True
+        return grouped[i]
+
     for alignment in grouped_first:
         read_group = [alignment]
-        rnext = _get_rnext(alignment)
-        rnext = _get_qname(alignment) if rnext == '=' \
+        rnext = get_rnext(alignment)
+        rnext = get_qname(alignment) if rnext == '=' \
                 else None if rnext == '*' else rnext
 
         # Consider grouped_middles
-        i = 0
-        while i < len(grouped_middle) and rnext != None:
-            consider = grouped_middle[i]
-            consider_qname = _get_qname(consider)
-            # The i'th read is the next segment.
-            if consider_qname == rnext:
-                read_group.append(consider)
-                rnext = _get_rnext(consider)
-                rnext = _get_qname(consider) if rnext == '=' \
-                        else None if rnext == '*' else rnext
-                grouped_middle.pop(i)
-            # The i'th read is not the next segment.
-            else:
-                i += 1
+        while rnext in middle_by_qname:
+            consider = pop_by_qname(
+                    middle_by_qname, rnext, grouped_middle, middle_consumed)
+            read_group.append(consider)
+            rnext = get_rnext(consider)
+            rnext = get_qname(consider) if rnext == '=' \
+                    else None if rnext == '*' else rnext
 
         # Consider grouped_last
-        for i, consider in enumerate(grouped_last):
-            consider_qname = _get_qname(consider)
-            if consider_qname == rnext:
-                read_group.append(consider)
-                grouped_last.pop(i)
-                break
+        if rnext in last_by_qname:
+            read_group.append(pop_by_qname(
+                    last_by_qname, rnext, grouped_last, last_consumed))
 
         # If no next segment can be found from a first segment, consider it
         # orphaned
@@ -391,30 +440,128 @@ def _get_read_groups(alignments):
         elif not is_last_segment(read_group[-1]):
             logger.warning(
                     'Read group with first segment {} does not end with a '
-                    'last segment.'.format(_get_qname(read_group[0])))
+                    'last segment.'.format(get_qname(read_group[0])))
 
-        read_groups.append(read_group)
+        read_groups.append([record[0] for record in read_group])
         num_grouped['has_group'] += len(read_group)
 
     # Reads that were marked as group, but not belonging to any read group.
     # TODO: find groups within the leftovers.
-    grouped_orphans += grouped_middle + grouped_last
+    grouped_orphans += [record for record, consumed
+            in zip(grouped_middle, middle_consumed) if not consumed]
+    grouped_orphans += [record for record, consumed
+            in zip(grouped_last, last_consumed) if not consumed]
 
     logger.info(
             'Found {} total reads. {} were ungrouped. {} were grouped into '
             '{} read groups. {} were orphaned reads.'.format(
-                    len(alignments), len(alignments_ungrouped),
+                    len(alignments_ungrouped) + num_grouped['total_segments'],
+                    len(alignments_ungrouped),
                     num_grouped['has_group'], len(read_groups),
                     len(grouped_orphans)))
 
-    return read_groups + [[alignment] for alignment in alignments_ungrouped] + \
-            [[alignment] for alignment in grouped_orphans]
+    return read_groups + \
+            [[alignment] for alignment in alignments_ungrouped] + \
+            [[record[0]] for record in grouped_orphans]
 
-def _get_flags(alignment):
+@functools.lru_cache(maxsize=65536)
+def _get_region_offsets(cigar, skip_tolerance, map_tolerance):
+    r"""
+    Implements ``Segment._get_cigar_region_list`` for a segment mapped at
+    position 0, giving a ``tuple`` of (start, stop) offsets of each region and
+    a ``tuple`` of the junction keyword arguments for ``SpliceList``. These
+    depend on the CIGAR string and tolerances alone, and the tolerances are
+    fixed across a run, so they are found once for each distinct CIGAR string.
+    """
+    # Most segments are a single match, possibly soft clipped, so these are
+    # handled without parsing the CIGAR string into runs
+    if cigar.endswith('M') and cigar[:-1].isdigit():
+        clipped_match = (None, cigar[:-1], None)
+    else:
+        match = _CLIPPED_MATCH_CIGAR_RE.match(cigar)
+        clipped_match = match.groups() if match != None else None
+    # A match of length 0 maps nothing, leaving only soft clips; these are
+    # left to the general case
+    if clipped_match != None and int(clipped_match[1]) > 0:
+        left_soft_clip, n, right_soft_clip = clipped_match
+        n = int(n)
+        return ((0, n-1),) if n >= map_tolerance else (), (
+                ('set_left_junction', left_soft_clip != None and
+                        int(left_soft_clip) > skip_tolerance),
+                ('set_right_junction', right_soft_clip != None and
+                        int(right_soft_clip) > skip_tolerance))
+
+    left_soft_clip, right_soft_clip, run_maps, run_lengths, run_starts = \
+            _get_cigar_runs(cigar)
+    # Translate skip and non-skip as regions in a single pass: skips within
+    # skip_tolerance are treated as non-skips, extending the region being
+    # built, and regions which span < map_tolerance are dropped. Follow the
+    # GTF indexing: inclusive on both sides.
+    offsets = []
+    region_start = None  # also a flag for whether a region is being built
+    for op, n, offset in zip(run_maps, run_lengths, run_starts):
+        if op == True or n <= skip_tolerance:
+            if region_start == None:
+                region_start = offset
+        elif region_start != None:
+            if offset - region_start >= map_tolerance:
+                offsets.append((region_start, offset-1))
+            region_start = None
+    if region_start != None:
+        offset = run_starts[-1] + run_lengths[-1]
+        if offset - region_start >= map_tolerance:
+            offsets.append((region_start, offset-1))
+
+    return tuple(offsets), (
+            ('set_left_junction', left_soft_clip > skip_tolerance),
+            ('set_right_junction', right_soft_clip > skip_tolerance))
+
+def _get_cigar_runs(cigar):
+    r"""
+    Given a CIGAR string, get its left and right soft clip lengths, and the
+    runs of operations between the soft clips as two ``tuple``\ s: whether
+    each run is of non-skips (True) or skips (False), and the length of each
+    run. The offset of the start of each run from the start of the first is
+    given as a third ``tuple``.
+    """
+    # Remove ops mapping the transcript only (e.g. insertions into ref); but
+    # retain soft_clips to determine if SpliceList should mark the left or
+    # right or both ends as Junctions. Operations of length 0 are removed too,
+    # so that they do not split the runs on either side of them.
+    encoding = Segment._CIGAR_ENCODING
+    operations = [(op, n) for op, n in _parse_cigar(cigar)
+            if (op in encoding or op == 'S') and n > 0]
+    start = 0
+    while start < len(operations) and operations[start][0] == 'S':
+        start += 1
+    stop = len(operations)
+    while stop > 0 and operations[stop-1][0] == 'S':
+        stop -= 1
+    left_soft_clip = sum(n for _, n in operations[:start])
+    right_soft_clip = sum(n for _, n in operations[stop:])
+    # Once soft clips are checked, remove them. Soft clips within the segment
+    # map neither, so they are removed too.
+    operations = [(op, n) for op, n in operations[start:stop] if op != 'S']
+    # Encode non-skips as True and skips as False, summing adjacent operations
+    # of the same encoding
+    run_maps = []
+    run_lengths = []
+    for maps, ops in groupby(operations, key=lambda op: encoding[op[0]]):
+        run_maps.append(maps)
+        run_lengths.append(sum(n for _, n in ops))
+    run_starts = (0,) + tuple(accumulate(run_lengths[:-1]))
+    return (left_soft_clip, right_soft_clip,
+            tuple(run_maps), tuple(run_lengths), run_starts)
+
+def _parse_cigar(cigar):
     r"""
-    Given a SAM alignment line, get the bitwise FLAGs as int
+    Given a CIGAR string, get a ``tuple`` of tuple<operation, occurences>, one
+    for each operation of the CIGAR string.
     """
-    return int(alignment.split('\t')[1])
+    if cigar == '*':
+        raise NoMappingError
+    return tuple((op, int(n))
+            for n, op in _CIGAR_RE.findall(cigar))
 
 def _get_qname(alignment):
     r"""
@@ -424,10 +571,4 @@ def _get_qname(alignment):
     """
     if alignment == None:
         return None
-    return alignment.split('\t')[0]
-
-def _get_rnext(alignment):
-    r"""
-    Given a SAM alignment line, get the RNEXT field as str
-    """
-    return alignment.split('\t')[6]
+    return alignment.partition('\t')[0]
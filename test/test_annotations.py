@@ -6,7 +6,8 @@ sys.path.append(os.path.join(sys.path[0], '../src'))
 from test_annotations_cases import *
 from splice_list import SpliceList
 from annotations import Annotations
-from transcript import Transcript
+import transcript
+from transcript import Transcript, get_annotated_alignments
 
 regions_variants = [[NM_001110556_exons, NM_001456_exons, pre_mRNA_whole]]
 
@@ -51,6 +52,19 @@ def test_NM_001456_only(flna_annotations, args):
     assert flna_annotations.get_annotations(
             transcript, args['junction_tolerance']) == ['NM_001456']
 
+def test_get_annotated_alignments_pool(flna_annotations, monkeypatch):
+    # Use a pool however few the read groups
+    monkeypatch.setattr(transcript, 'POOL_MIN_GROUPS', 0)
+    cases = pre_mRNA_only + mature_mRNA_only + NM_001456_only
+    alignments = [sam for args in cases for sam in args['transcript_args'][0]]
+
+    def annotate(processes):
+        return get_annotated_alignments(
+                alignments, flna_annotations, 10, 0, 10, processes)
+    annotated = annotate(1)
+    assert any('TR:Z:NM_' in sam for sam in annotated)
+    assert annotate(2) == annotated
+
 def test_completely_ambiguous(flna_annotations):
     pass
 
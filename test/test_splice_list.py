@@ -42,7 +42,24 @@ def test_splice_list_contains_True(exons1, exons2, match_tolerance):
     assert splice_list1.contains(splice_list2, match_tolerance) == True
 
 @pytest.mark.parametrize('exons1,exons2,match_tolerance', non_matching_exons)
-def test_splice_list_contains_True(exons1, exons2, match_tolerance):
+def test_splice_list_contains_False(exons1, exons2, match_tolerance):
     splice_list1 = SpliceList('test', exons1)
     splice_list2 = SpliceList('test', exons2)
     assert splice_list1.contains(splice_list2, match_tolerance) == False
+
+@pytest.mark.parametrize('exons1,exons2', shared_junction_exons)
+@pytest.mark.parametrize('complemented_first', [True, False])
+def test_splice_list_join_shared_junction(exons1, exons2, complemented_first):
+    splice_list1 = SpliceList('test', exons1)
+    splice_list2 = SpliceList('test', exons2)
+    # Complement the junctions of the intron in one SpliceList only
+    end, start = splice_list2.junctions
+    end.complement = start
+    start.complement = end
+    if complemented_first:
+        splice_list1, splice_list2 = splice_list2, splice_list1
+
+    joined = SpliceList.join(splice_list1, splice_list2)
+    assert [(j.position, j.type) for j in joined.junctions] == \
+            [(end.position, end.type), (start.position, start.type)]
+    assert all(j.complement != None for j in joined.junctions)
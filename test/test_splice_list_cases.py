@@ -57,6 +57,11 @@ matching_exons = [
             [(1,10), (11, 20), (31, 40)],
             [(11, 20)],
             0
+        ],
+        [
+            [(3, 10)],
+            [(1, 12)],
+            2
         ]
 ]
 
@@ -81,4 +86,20 @@ non_matching_exons = [
             [(2,12), (13, 21), (31, 40)],
             1
         ],
+        [
+            [(35, 44), (57, 64)],
+            [(30, 47)],
+            3
+        ],
+        [
+            [(1, 10), (20, 30)],
+            [(5, 12), (13, 16)],
+            4
+        ],
+]
+
+# Pairs of exons sharing the intron between the two exons of each
+shared_junction_exons = [
+        (((100, 200), (300, 400)), ((150, 200), (300, 350))),
+        (((100, 200), (300, 400)), ((100, 200), (300, 400)))
 ]
@@ -4,17 +4,20 @@ import pytest
 sys.path.append(os.path.join(sys.path[0], '../trcls'))
 
 from test_transcript_cases import *
-from transcript import Transcript, Segment, _get_read_groups, \
+from transcript import Transcript, Segment, _get_read_groups, _parse_cigar, \
         NoMappingError, NoMappedSegmentsError
 from cli import DEFAULT_JUNCTION, DEFAULT_MAP, DEFAULT_SKIP
 
-@pytest.mark.parametrize('cigar,cigar_expanded', cigar_and_cigar_expanded)
-def test_Segment_expand_cigar(cigar, cigar_expanded):
-    assert Segment._expand_cigar(cigar) == cigar_expanded
+@pytest.mark.parametrize('cigar,cigar_parsed', cigar_and_cigar_parsed)
+def test_parse_cigar(cigar, cigar_parsed):
+    assert _parse_cigar(cigar) == cigar_parsed
 
 @pytest.mark.parametrize('sam,regions,skip_tolerance,map_tolerance', sam_and_regions)
-def test_Segment_get_region_list(sam, regions, skip_tolerance, map_tolerance):
-    assert Segment._get_region_list(sam, skip_tolerance, map_tolerance) == regions
+def test_Segment_get_cigar_region_list(
+        sam, regions, skip_tolerance, map_tolerance):
+    fields = sam.split('\t')
+    assert Segment._get_cigar_region_list(int(fields[3]), fields[5],
+            skip_tolerance, map_tolerance) == regions
 
 @pytest.mark.parametrize('alignments,groups', transcript_groups)
 def test_get_read_groups(alignments, groups):
@@ -1,9 +1,14 @@
-cigar_and_cigar_expanded = [
-    ('8S3M', 'SSSSSSSSMMM'), ('9S4M2D3M', 'SSSSSSSSSMMMMDDMMM'),
-    ('7S4M1D4M', 'SSSSSSSMMMMDMMMM'), ('1S2M2D8M', 'SMMDDMMMMMMMM'),
-    ('10M1D4M', 'MMMMMMMMMMDMMMM'), ('5S7M1I3M2S', 'SSSSSMMMMMMMIMMMSS'),
-    ('1M4D3M', 'MDDDDMMM'), ('9S4M1S', 'SSSSSSSSSMMMMS'),
-    ('11S11M1D2M', 'SSSSSSSSSSSMMMMMMMMMMMDMM'), ('1S1M1D1I1S', 'SMDIS')
+cigar_and_cigar_parsed = [
+    ('8S3M', (('S', 8), ('M', 3))),
+    ('9S4M2D3M', (('S', 9), ('M', 4), ('D', 2), ('M', 3))),
+    ('7S4M1D4M', (('S', 7), ('M', 4), ('D', 1), ('M', 4))),
+    ('1S2M2D8M', (('S', 1), ('M', 2), ('D', 2), ('M', 8))),
+    ('10M1D4M', (('M', 10), ('D', 1), ('M', 4))),
+    ('5S7M1I3M2S', (('S', 5), ('M', 7), ('I', 1), ('M', 3), ('S', 2))),
+    ('1M4D3M', (('M', 1), ('D', 4), ('M', 3))),
+    ('9S4M1S', (('S', 9), ('M', 4), ('S', 1))),
+    ('11S11M1D2M', (('S', 11), ('M', 11), ('D', 1), ('M', 2))),
+    ('1S1M1D1I1S', (('S', 1), ('M', 1), ('D', 1), ('I', 1), ('S', 1)))
 ]
 
 sam_and_regions = [
@@ -15,6 +20,14 @@ sam_and_regions = [
         ),
         0, 0
     ],
+    [
+        'K00270:121:HWNJGBBXX:6:1105:11759:9807	99	chrX	154348425	44	18S120M10S	=	154348746	483	GTCAAGGCCAACCTGACAGAGGTGACCTGTGCTCAGCCCATGCTTTGATCTGCTCATTGGCACCCCTGTCAGGTTGGCCTTGACTGGTCCTCCAACCCCAGCAAAGCTACAGCCACGCAAAGGAGAATGGAAGCAAAACTTTATTCCT	AAFFFJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJFJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJAFJFFFJFFJJFJFFFJJJJJJJJJJJJJJ	AS:i:250	XN:i:0	XM:i:2	XO:i:0	XG:i:0	NM:i:2	MD:Z:72C9A47	YS:i:288	YT:Z:CP',
+        (
+            [[154348425, 154348544]],
+            {'set_left_junction': True, 'set_right_junction': False}
+        ),
+        10, 0
+    ],
     [
         'K00270:121:HWNJGBBXX:6:1210:26433:35514	99	chrX	154348435	42	112M26D37M	=	154348447	188	GTGCTCAGCCCATGCTTTGATCTGCTCAATGGCACCCCTGTCAGGTTGGTCCTGGCTGGTCCCCCAACCCCAACAAAGCTACAGCCACGCAAAGGAGAATGGAAGCAAAACTATAGTGGGTGGTTGTGTACAGGACTCCCATCCCTCAC	AAFFFJJJJJJJJJFJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJFJJJJJJJJJJJJJJJFJJJFJJJJFJJJJFFJJJJJJJJJJJ<JJJJJJJJJJFJA<--7FA)AFJ<JAJJ	AS:i:239	XN:i:0	XM:i:6	XO:i:1	XG:i:26	NM:i:32	MD:Z:28T20C1T2A57^TTATTCCTCTTGGCTGGAGAAGAGAA0C23C12	YS:i:245	YT:Z:CP',
         (
@@ -23,6 +36,38 @@ sam_and_regions = [
         ),
         0, 0
     ],
+    [
+        'K00270:121:HWNJGBBXX:6:1210:26433:35514	99	chrX	154348435	42	112M10D16N37M	=	154348447	188	GTGCTCAGCCCATGCTTTGATCTGCTCAATGGCACCCCTGTCAGGTTGGTCCTGGCTGGTCCCCCAACCCCAACAAAGCTACAGCCACGCAAAGGAGAATGGAAGCAAAACTATAGTGGGTGGTTGTGTACAGGACTCCCATCCCTCAC	AAFFFJJJJJJJJJFJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJFJJJJJJJJJJJJJJJFJJJFJJJJFJJJJFFJJJJJJJJJJJ<JJJJJJJJJJFJA<--7FA)AFJ<JAJJ	AS:i:239	XN:i:0	XM:i:6	XO:i:1	XG:i:26	NM:i:32	MD:Z:28T20C1T2A57^TTATTCCTCTTGGCTGGAGAAGAGAA0C23C12	YS:i:245	YT:Z:CP',
+        (
+            [[154348435, 154348546], [154348573, 154348609]],
+            {'set_left_junction': False, 'set_right_junction': False}
+        ),
+        20, 0
+    ],
+    [
+        'K00270:121:HWNJGBBXX:6:1210:26433:35514	99	chrX	154348435	42	10M5S10M	=	154348447	188	GTGCTCAGCCCATGCTTTGATCTGCTCAATGGCACCCCTGTCAGGTTGGTCCTGGCTGGTCCCCCAACCCCAACAAAGCTACAGCCACGCAAAGGAGAATGGAAGCAAAACTATAGTGGGTGGTTGTGTACAGGACTCCCATCCCTCAC	AAFFFJJJJJJJJJFJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJFJJJJJJJJJJJJJJJFJJJFJJJJFJJJJFFJJJJJJJJJJJ<JJJJJJJJJJFJA<--7FA)AFJ<JAJJ	AS:i:239	XN:i:0	XM:i:6	XO:i:1	XG:i:26	NM:i:32	MD:Z:28T20C1T2A57^TTATTCCTCTTGGCTGGAGAAGAGAA0C23C12	YS:i:245	YT:Z:CP',
+        (
+            [[154348435, 154348454]],
+            {'set_left_junction': False, 'set_right_junction': False}
+        ),
+        0, 0
+    ],
+    [
+        'K00270:121:HWNJGBBXX:6:1210:26433:35514	99	chrX	154348435	42	12D0M41D	=	154348447	188	GTGCTCAGCCCATGCTTTGATCTGCTCAATGGCACCCCTGTCAGGTTGGTCCTGGCTGGTCCCCCAACCCCAACAAAGCTACAGCCACGCAAAGGAGAATGGAAGCAAAACTATAGTGGGTGGTTGTGTACAGGACTCCCATCCCTCAC	AAFFFJJJJJJJJJFJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJFJJJJJJJJJJJJJJJFJJJFJJJJFJJJJFFJJJJJJJJJJJ<JJJJJJJJJJFJA<--7FA)AFJ<JAJJ	AS:i:239	XN:i:0	XM:i:6	XO:i:1	XG:i:26	NM:i:32	MD:Z:28T20C1T2A57^TTATTCCTCTTGGCTGGAGAAGAGAA0C23C12	YS:i:245	YT:Z:CP',
+        (
+            [],
+            {'set_left_junction': False, 'set_right_junction': False}
+        ),
+        18, 8
+    ],
+    [
+        'K00270:121:HWNJGBBXX:6:1210:26433:35514	99	chrX	154348435	42	5S0M5S	=	154348447	188	GTGCTCAGCCCATGCTTTGATCTGCTCAATGGCACCCCTGTCAGGTTGGTCCTGGCTGGTCCCCCAACCCCAACAAAGCTACAGCCACGCAAAGGAGAATGGAAGCAAAACTATAGTGGGTGGTTGTGTACAGGACTCCCATCCCTCAC	AAFFFJJJJJJJJJFJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJFJJJJJJJJJJJJJJJFJJJFJJJJFJJJJFFJJJJJJJJJJJ<JJJJJJJJJJFJA<--7FA)AFJ<JAJJ	AS:i:239	XN:i:0	XM:i:6	XO:i:1	XG:i:26	NM:i:32	MD:Z:28T20C1T2A57^TTATTCCTCTTGGCTGGAGAAGAGAA0C23C12	YS:i:245	YT:Z:CP',
+        (
+            [],
+            {'set_left_junction': True, 'set_right_junction': True}
+        ),
+        2, 0
+    ],
     [
         'K00270:121:HWNJGBBXX:6:1210:26433:35514	99	chrX	154348435	42	112M26D37M	=	154348447	188	GTGCTCAGCCCATGCTTTGATCTGCTCAATGGCACCCCTGTCAGGTTGGTCCTGGCTGGTCCCCCAACCCCAACAAAGCTACAGCCACGCAAAGGAGAATGGAAGCAAAACTATAGTGGGTGGTTGTGTACAGGACTCCCATCCCTCAC	AAFFFJJJJJJJJJFJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJFJJJJJJJJJJJJJJJFJJJFJJJJFJJJJFFJJJJJJJJJJJ<JJJJJJJJJJFJA<--7FA)AFJ<JAJJ	AS:i:239	XN:i:0	XM:i:6	XO:i:1	XG:i:26	NM:i:32	MD:Z:28T20C1T2A57^TTATTCCTCTTGGCTGGAGAAGAGAA0C23C12	YS:i:245	YT:Z:CP',
         (
@@ -30,6 +75,14 @@ sam_and_regions = [
             {'set_left_junction': False, 'set_right_junction': False}
         ),
         26, 0
+    ],
+    [
+        'K00270:121:HWNJGBBXX:6:1210:26433:35514	99	chrX	154348435	42	2D147M	=	154348447	188	GTGCTCAGCCCATGCTTTGATCTGCTCAATGGCACCCCTGTCAGGTTGGTCCTGGCTGGTCCCCCAACCCCAACAAAGCTACAGCCACGCAAAGGAGAATGGAAGCAAAACTATAGTGGGTGGTTGTGTACAGGACTCCCATCCCTCAC	AAFFFJJJJJJJJJFJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJJFJJJJJJJJJJJJJJJFJJJFJJJJFJJJJFFJJJJJJJJJJJ<JJJJJJJJJJFJA<--7FA)AFJ<JAJJ	AS:i:239	XN:i:0	XM:i:6	XO:i:1	XG:i:26	NM:i:32	MD:Z:28T20C1T2A57^TTATTCCTCTTGGCTGGAGAAGAGAA0C23C12	YS:i:245	YT:Z:CP',
+        (
+            [[154348435, 154348583]],
+            {'set_left_junction': False, 'set_right_junction': False}
+        ),
+        20, 0
     ]
 ]
 
@@ -59,6 +112,22 @@ transcript_groups = [
             'K00270:121:HWNJGBBXX:6:1105:11759:9807	147	chrX	154348746	44	144M	=	154348425	-483	GCGGGCGGCCAGGGCGGCCTGGGCCGGGGTTGAGGGGAAGAGGGCGGGGCTGCTTGGGTAGCGGGGCAGGCTTGGGGGCTGCCGGCTGGCACGGGCCCCAGACTCAGGGCACCACAACGCGGTAGGGGCTGCCTGGGATGTGCT	JJJJJFJJFA-JJJ-JFJFJJJJFAJJJJJJJJJJJJJFF<JJJJJJFJJJJFAJJJJFJJJJJJFJFJJJJ<JJJJJJJJJJJJJFJJJJJJJJFFJJJFJFJJJJJJJJJJJJJJJJJJJJJJJJJJJJJFFJJJJJFFFAA	AS:i:288	XN:i:0	XM:i:0	XO:i:0	XG:i:0	NM:i:0	MD:Z:144	YS:i:250	YT:Z:CP'
         ]]
     ),
+    (
+        # The RNEXT chain r1, r3, r2, r4 goes back to a middle segment which
+        # comes before the last one followed
+        [
+            'r1\t65\tchrX\t1000\t44\t50M\tr3\t0\t0\t*\t*',
+            'r2\t1\tchrX\t1100\t44\t50M\tr4\t0\t0\t*\t*',
+            'r3\t1\tchrX\t1200\t44\t50M\tr2\t0\t0\t*\t*',
+            'r4\t129\tchrX\t1300\t44\t50M\t*\t0\t0\t*\t*'
+        ],
+        [[
+            'r1\t65\tchrX\t1000\t44\t50M\tr3\t0\t0\t*\t*',
+            'r3\t1\tchrX\t1200\t44\t50M\tr2\t0\t0\t*\t*',
+            'r2\t1\tchrX\t1100\t44\t50M\tr4\t0\t0\t*\t*',
+            'r4\t129\tchrX\t1300\t44\t50M\t*\t0\t0\t*\t*'
+        ]]
+    ),
 ]
 
 no_mapping = [